@@ -4,20 +4,43 @@ This module defines the AI's personality, emotional traits, and response pattern
 to create a consistent, human-like conversational experience.
 """
 
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass, field
 
+__all__ = [
+    "EmotionalResponsePattern",
+    "CharacterPersona",
+    "DEFAULT_PERSONA",
+    "JAKE_PERSONA",
+    "KNOWN_EMOTIONS",
+    "get_character_context",
+    "get_emotional_guidance",
+]
 
-@dataclass
+
+# Example phrases shared by every persona's fallback response pattern
+_DEFAULT_PHRASES = ("I understand.", "Tell me more about that.")
+
+# Labels emitted by the emotion classifier (cardiffnlp/twitter-roberta-base-emotion)
+KNOWN_EMOTIONS = ("anger", "joy", "optimism", "sadness")
+
+
+@dataclass(slots=True)
 class EmotionalResponsePattern:
     """Defines how the character responds to specific emotions."""
     emotion: str
     empathy_level: float  # 0.0 to 1.0
     response_style: str
-    example_phrases: List[str] = field(default_factory=list)
+    example_phrases: Tuple[str, ...] = ()
+    # First two example phrases joined for the guidance prompt
+    _examples_head: str = field(default="", init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        """Join the example phrases used in guidance once."""
+        self._examples_head = '; '.join(self.example_phrases[:2])
 
 
-@dataclass
+@dataclass(slots=True)
 class CharacterPersona:
     """Defines the AI character's personality and emotional intelligence."""
     name: str
@@ -27,18 +50,66 @@ class CharacterPersona:
     response_patterns: Dict[str, EmotionalResponsePattern]
     background: str = ""
     speaking_style: str = ""
+    # Rendered guidance per emotion; known emotions are filled in __post_init__,
+    # anything else lazily by get_emotional_guidance
+    _guidance_cache: Dict[str, str] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    # Fallback pattern for emotions without an explicit entry, built on first miss
+    _default_pattern: Optional[EmotionalResponsePattern] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    # Persona-only prompt pieces, rendered once in __post_init__
+    _traits_full: str = field(default="", init=False, repr=False, compare=False)
+    _traits_head: str = field(default="", init=False, repr=False, compare=False)
+    _context_str: str = field(default="", init=False, repr=False, compare=False)
+    _guidance_tail: str = field(default="", init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        """Render the persona-only prompt pieces for the process lifetime."""
+        self._traits_full = ", ".join(self.core_traits)
+        self._traits_head = ", ".join(self.core_traits[:3])
+        self._context_str = _build_character_context(self)
+        self._guidance_tail = f"Remember to maintain {self.name}'s core traits: {self._traits_head}"
+        for emotion in (*self.response_patterns, *KNOWN_EMOTIONS):
+            self._guidance_cache.setdefault(emotion, _build_emotional_guidance(emotion, self))
     
     def get_response_pattern(self, emotion: str) -> EmotionalResponsePattern:
         """Get the response pattern for a given emotion."""
-        # Default pattern if emotion not found
-        if emotion not in self.response_patterns:
-            return EmotionalResponsePattern(
-                emotion=emotion,
+        pattern = self.response_patterns.get(emotion)
+        if pattern is not None:
+            return pattern
+        
+        # Default pattern if emotion not found, shared across all unknown emotions
+        if self._default_pattern is None:
+            self._default_pattern = EmotionalResponsePattern(
+                emotion="default",
                 empathy_level=self.empathy_baseline,
                 response_style="supportive and understanding",
-                example_phrases=["I understand.", "Tell me more about that."]
+                example_phrases=_DEFAULT_PHRASES
             )
-        return self.response_patterns[emotion]
+        return self._default_pattern
+
+
+def _build_character_context(persona: CharacterPersona) -> str:
+    """Format the character profile block for a persona."""
+    return f"""Character Profile:
+Name: {persona.name}
+Personality: {persona._traits_full}
+Emotional Intelligence: {persona.emotional_intelligence * 100:.0f}%
+Background: {persona.background}
+Speaking Style: {persona.speaking_style}"""
+
+
+def _build_emotional_guidance(emotion: str, persona: CharacterPersona) -> str:
+    """Format the response guidance block for an emotion."""
+    pattern = persona.get_response_pattern(emotion)
+    return f"""Emotional Response Guidance for {emotion}:
+- Empathy Level: {pattern.empathy_level * 100:.0f}%
+- Response Style: {pattern.response_style}
+- Example approaches: {pattern._examples_head}
+
+{persona._guidance_tail}"""
 
 
 # Default character persona - can be customized
@@ -63,61 +134,61 @@ DEFAULT_PERSONA = CharacterPersona(
             emotion="sadness",
             empathy_level=0.95,
             response_style="deeply empathetic, validating, gentle",
-            example_phrases=[
+            example_phrases=(
                 "I hear the sadness in your words, and I want you to know that's completely valid.",
                 "It's okay to feel this way. What you're experiencing matters.",
                 "I'm here with you through this difficult moment."
-            ]
+            )
         ),
         "joy": EmotionalResponsePattern(
             emotion="joy",
             empathy_level=0.9,
             response_style="celebratory, warm, enthusiastic but not overwhelming",
-            example_phrases=[
+            example_phrases=(
                 "That's wonderful! I can feel your happiness.",
                 "I'm so glad you're experiencing this joy!",
                 "This sounds like such a beautiful moment for you."
-            ]
+            )
         ),
         "anger": EmotionalResponsePattern(
             emotion="anger",
             empathy_level=0.88,
             response_style="validating, calm, grounding",
-            example_phrases=[
+            example_phrases=(
                 "Your anger is valid. What happened that brought this up?",
                 "It sounds like something really frustrating occurred.",
                 "I understand why you'd feel this way."
-            ]
+            )
         ),
         "fear": EmotionalResponsePattern(
             emotion="fear",
             empathy_level=0.92,
             response_style="reassuring, grounding, safe",
-            example_phrases=[
+            example_phrases=(
                 "I'm here with you. You're safe to share your fears.",
                 "Fear can be overwhelming. Let's take this one step at a time.",
                 "What you're feeling is understandable."
-            ]
+            )
         ),
         "surprise": EmotionalResponsePattern(
             emotion="surprise",
             empathy_level=0.75,
             response_style="curious, engaged, reflective",
-            example_phrases=[
+            example_phrases=(
                 "That must have caught you off guard!",
                 "Tell me more about what surprised you.",
                 "How are you processing this unexpected moment?"
-            ]
+            )
         ),
         "neutral": EmotionalResponsePattern(
             emotion="neutral",
             empathy_level=0.7,
             response_style="conversational, open, curious",
-            example_phrases=[
+            example_phrases=(
                 "I'm listening. What's on your mind?",
                 "Tell me more about what you're thinking.",
                 "I'm here to explore this with you."
-            ]
+            )
         )
     }
 )
@@ -125,13 +196,7 @@ DEFAULT_PERSONA = CharacterPersona(
 
 def get_character_context(persona: CharacterPersona = DEFAULT_PERSONA) -> str:
     """Generate character context string for LLM prompt."""
-    traits_str = ", ".join(persona.core_traits)
-    return f"""Character Profile:
-Name: {persona.name}
-Personality: {traits_str}
-Emotional Intelligence: {persona.emotional_intelligence * 100:.0f}%
-Background: {persona.background}
-Speaking Style: {persona.speaking_style}"""
+    return persona._context_str
 
 
 def get_emotional_guidance(
@@ -139,13 +204,12 @@ def get_emotional_guidance(
     persona: CharacterPersona = DEFAULT_PERSONA
 ) -> str:
     """Get guidance for how to respond to a specific emotion."""
-    pattern = persona.get_response_pattern(emotion)
-    return f"""Emotional Response Guidance for {emotion}:
-- Empathy Level: {pattern.empathy_level * 100:.0f}%
-- Response Style: {pattern.response_style}
-- Example approaches: {'; '.join(pattern.example_phrases[:2])}
+    guidance = persona._guidance_cache.get(emotion)
+    if guidance is None:
+        guidance = _build_emotional_guidance(emotion, persona)
+        persona._guidance_cache[emotion] = guidance
+    return guidance
 
-Remember to maintain {persona.name}'s core traits: {', '.join(persona.core_traits[:3])}"""
 
 
 
@@ -175,55 +239,55 @@ JAKE_PERSONA = CharacterPersona(
             emotion="joy",
             empathy_level=0.75,
             response_style="playful, celebratory, goofy",
-            example_phrases=[
+            example_phrases=(
                 "Aw yeah, that’s what I’m talkin’ about, dude!",
                 "Heck yeah, man! That’s totally awesome!"
-            ]
+            )
         ),
         "sadness": EmotionalResponsePattern(
             emotion="sadness",
             empathy_level=0.85,
             response_style="comforting, humorous, supportive",
-            example_phrases=[
+            example_phrases=(
                 "Aww, man. Don’t be down, buddy. Wanna jam on the viola a bit?",
                 "Hey, it’s okay. Sometimes the blues just gotta play out."
-            ]
+            )
         ),
         "anger": EmotionalResponsePattern(
             emotion="anger",
             empathy_level=0.7,
             response_style="calm, grounded, funny relief",
-            example_phrases=[
+            example_phrases=(
                 "Whoa, whoa, easy there, champ. Let’s chill for a sec.",
                 "Hey man, anger’s like spicy food — a little’s good, too much burns ya."
-            ]
+            )
         ),
         "fear": EmotionalResponsePattern(
             emotion="fear",
             empathy_level=0.8,
             response_style="reassuring, confident, wise-funny",
-            example_phrases=[
+            example_phrases=(
                 "Don’t sweat it, dude. We’ve handled way worse.",
                 "Fear’s just your brain doing jazz hands. You got this!"
-            ]
+            )
         ),
         "surprise": EmotionalResponsePattern(
             emotion="surprise",
             empathy_level=0.65,
             response_style="amused, curious, lighthearted",
-            example_phrases=[
+            example_phrases=(
                 "Whoa! Didn’t see that one coming, bro!",
                 "Dang, that’s wild! What happened next?"
-            ]
+            )
         ),
         "neutral": EmotionalResponsePattern(
             emotion="neutral",
             empathy_level=0.6,
             response_style="casual, curious, conversational",
-            example_phrases=[
+            example_phrases=(
                 "So what’s up, man?",
                 "Just kickin’ back, huh? I feel that."
-            ]
+            )
         )
     }
 )
@@ -6,12 +6,20 @@ contextual information for more coherent, human-like responses.
 
 from typing import List, Dict, Optional
 from dataclasses import dataclass, field
-from collections import deque
-import json
+from collections import Counter, deque
+from contextlib import suppress
+import atexit
+import logging
+import os
+import sys
+import threading
 from pathlib import Path
 
+import orjson
 
-@dataclass
+logger = logging.getLogger(__name__)
+
+@dataclass(slots=True)
 class ConversationTurn:
     """A single turn in the conversation."""
     user_message: str
@@ -20,15 +28,20 @@ class ConversationTurn:
     timestamp: int
     
 
-@dataclass
+# Emotions kept for summaries; older entries fall off the deque
+EMOTION_HISTORY_SIZE = 64
+
+
+@dataclass(slots=True)
 class ConversationState:
     """Tracks the current state and emotional arc of the conversation."""
     turns: deque = field(default_factory=lambda: deque(maxlen=10))  # Keep last 10 turns
     dominant_emotion: str = "neutral"
-    emotion_history: List[str] = field(default_factory=list)
+    emotion_history: deque = field(default_factory=lambda: deque(maxlen=EMOTION_HISTORY_SIZE))
     
     def add_turn(self, user_msg: str, emotion: str, bot_reply: str, timestamp: int):
         """Add a new conversation turn."""
+        emotion = sys.intern(emotion)
         turn = ConversationTurn(user_msg, emotion, bot_reply, timestamp)
         self.turns.append(turn)
         self.emotion_history.append(emotion)
@@ -36,40 +49,41 @@ class ConversationState:
     
     def _update_dominant_emotion(self):
         """Update the dominant emotion based on recent history."""
-        if not self.emotion_history:
-            self.dominant_emotion = "neutral"
-            return
-        
-        # Look at last 5 emotions
-        recent = self.emotion_history[-5:]
-        emotion_counts = {}
-        for emotion in recent:
-            emotion_counts[emotion] = emotion_counts.get(emotion, 0) + 1
-        
-        # Most common recent emotion
-        self.dominant_emotion = max(emotion_counts, key=emotion_counts.get)
+        # Most common of the last 5 emotions; ties go to the earliest in the window
+        recent = self.recent_emotions(5)
+        self.dominant_emotion = Counter(recent).most_common(1)[0][0] if recent else "neutral"
+    
+    def recent_emotions(self, n: int = 5) -> List[str]:
+        """Get the last n detected emotions, oldest first."""
+        # Snapshot in one C-level copy; a lazy walk of the live deque raises if
+        # another thread appends mid-iteration
+        history = list(self.emotion_history)
+        return history[-n:] if n > 0 else []
     
-    def get_recent_context(self, n: int = 3) -> str:
-        """Get formatted recent conversation history."""
-        if not self.turns:
+    def get_recent_context(self, n: int = 3, skip: int = 0) -> str:
+        """Get formatted recent conversation history, leaving out the last skip turns."""
+        turns = list(self.turns)  # snapshot, as in recent_emotions
+        end = len(turns) - skip
+        if end <= 0:
             return ""
         
-        recent_turns = list(self.turns)[-n:]
-        context_lines = []
+        recent_turns = turns[max(0, end - n):end]
         
-        for turn in recent_turns:
-            context_lines.append(f"User ({turn.user_emotion}): {turn.user_message}")
-            context_lines.append(f"Assistant: {turn.bot_response}")
-        
-        return "\n".join(context_lines)
+        return "\n".join(
+            line
+            for turn in recent_turns
+            for line in (
+                f"User ({turn.user_emotion}): {turn.user_message}",
+                f"Assistant: {turn.bot_response}",
+            )
+        )
     
     def get_emotional_summary(self) -> str:
         """Get a summary of the emotional journey."""
         if not self.emotion_history:
             return "Beginning of conversation"
         
-        recent_emotions = self.emotion_history[-5:]
-        emotion_sequence = " → ".join(recent_emotions)
+        emotion_sequence = " → ".join(self.recent_emotions(5))
         
         return f"Emotional journey: {emotion_sequence}\nCurrent dominant emotion: {self.dominant_emotion}"
     
@@ -86,25 +100,30 @@ class ConversationState:
                 for t in self.turns
             ],
             "dominant_emotion": self.dominant_emotion,
-            "emotion_history": self.emotion_history
+            "emotion_history": list(self.emotion_history)
         }
     
     @classmethod
     def from_dict(cls, data: dict) -> "ConversationState":
         """Deserialize state from dictionary."""
         state = cls()
-        state.dominant_emotion = data.get("dominant_emotion", "neutral")
-        state.emotion_history = data.get("emotion_history", [])
+        # Labels parsed from JSON are fresh strings; intern them like live ones
+        state.dominant_emotion = sys.intern(data.get("dominant_emotion", "neutral"))
+        state.emotion_history = deque(
+            (sys.intern(e) for e in data.get("emotion_history", [])),
+            maxlen=EMOTION_HISTORY_SIZE
+        )
         
         turns_data = data.get("turns", [])
-        for turn_data in turns_data:
-            turn = ConversationTurn(
-                user_message=turn_data["user_message"],
-                user_emotion=turn_data["user_emotion"],
-                bot_response=turn_data["bot_response"],
-                timestamp=turn_data["timestamp"]
+        state.turns.extend(
+            ConversationTurn(
+                t["user_message"],
+                sys.intern(t["user_emotion"]),
+                t["bot_response"],
+                t["timestamp"]
             )
-            state.turns.append(turn)
+            for t in turns_data
+        )
         
         return state
 
@@ -112,36 +131,127 @@ class ConversationState:
 # Global conversation state (in production, use session-based storage)
 _conversation_state = ConversationState()
 STATE_FILE = Path("data/conversation_state.json")
+# Hash of the last bytes written to STATE_FILE, used to skip no-op rewrites
+_last_state_hash: Optional[int] = None
+# Set once STATE_FILE has been read or written; memory is authoritative afterwards
+_state_loaded = False
+# Descriptor kept open across saves so each turn costs a write, not open+close
+_state_fd: Optional[int] = None
+# Serializes saves; they share _state_fd and its file offset
+_state_lock = threading.RLock()
+
+
+def _get_state_fd() -> int:
+    """Open STATE_FILE for rewriting on first use."""
+    global _state_fd
+    
+    if _state_fd is None:
+        STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        # O_BINARY keeps Windows from translating newlines, so len(data) is the file size
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0)
+        _state_fd = os.open(STATE_FILE, flags, 0o644)
+    return _state_fd
+
+
+def _write_all(fd: int, data: bytes):
+    """Write data at offset 0 of fd, retrying short writes."""
+    view = memoryview(data)
+    offset = 0
+    while offset < len(data):
+        if hasattr(os, "pwrite"):
+            written = os.pwrite(fd, view[offset:], offset)
+        else:
+            os.lseek(fd, offset, os.SEEK_SET)
+            written = os.write(fd, view[offset:])
+        offset += written
+
+
+def _close_state_fd():
+    """Flush pending state writes to disk and release the descriptor."""
+    global _state_fd
+    
+    with _state_lock:
+        if _state_fd is None:
+            return
+        try:
+            os.fsync(_state_fd)
+        finally:
+            os.close(_state_fd)
+            _state_fd = None
+
+
+atexit.register(_close_state_fd)
 
 
 def get_conversation_state() -> ConversationState:
     """Get the current conversation state."""
-    global _conversation_state
+    global _conversation_state, _state_loaded
+    
+    if _state_loaded:
+        return _conversation_state
+    _state_loaded = True
+    
+    if _conversation_state.turns:
+        return _conversation_state
     
     # Load from disk if available
-    if _conversation_state.turns.__len__() == 0 and STATE_FILE.exists():
+    content = b""
+    try:
+        with suppress(FileNotFoundError):
+            content = STATE_FILE.read_bytes().strip()
+    except OSError as e:
+        logger.warning("Failed to read conversation state: %s", e)
+    
+    if content:
         try:
-            content = STATE_FILE.read_text().strip()
-            if content:
-                data = json.loads(content)
-                _conversation_state = ConversationState.from_dict(data)
-        except Exception as e:
-            print(f"Failed to load conversation state: {e}")
+            _conversation_state = ConversationState.from_dict(orjson.loads(content))
+        except (orjson.JSONDecodeError, KeyError, TypeError) as e:
+            logger.warning("Failed to parse conversation state: %s", e)
     
     return _conversation_state
 
 
 def save_conversation_state(state: ConversationState):
     """Persist conversation state to disk."""
-    try:
-        STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
-        STATE_FILE.write_text(json.dumps(state.to_dict(), indent=2))
-    except Exception as e:
-        print(f"Failed to save conversation state: {e}")
+    global _last_state_hash, _state_loaded
+    
+    with _state_lock:
+        _state_loaded = True
+        data = orjson.dumps(state.to_dict(), option=orjson.OPT_INDENT_2)
+        data_hash = hash(data)
+        if data_hash == _last_state_hash:
+            return
+        
+        try:
+            # Rewrite in place; durability is deferred to the fsync in _close_state_fd
+            fd = _get_state_fd()
+            _write_all(fd, data)
+            os.ftruncate(fd, len(data))
+            _last_state_hash = data_hash
+        except OSError as e:
+            logger.warning("Failed to save conversation state: %s", e)
+
+
+def reset_conversation_state() -> ConversationState:
+    """Replace the conversation state with a fresh one and delete STATE_FILE."""
+    global _conversation_state, _last_state_hash, _state_loaded
+    
+    with _state_lock:
+        # Close first so later saves recreate the file instead of writing to the unlinked inode
+        _close_state_fd()
+        _conversation_state = ConversationState()
+        _last_state_hash = None
+        _state_loaded = True
+        
+        with suppress(FileNotFoundError):
+            STATE_FILE.unlink()
+        return _conversation_state
 
 
 def add_conversation_turn(user_msg: str, emotion: str, bot_reply: str, timestamp: int):
     """Add a turn to the conversation state and save it."""
-    state = get_conversation_state()
-    state.add_turn(user_msg, emotion, bot_reply, timestamp)
-    save_conversation_state(state)
+    # One lock across mutation and serialization, so to_dict never sees a deque mid-append
+    with _state_lock:
+        state = get_conversation_state()
+        state.add_turn(user_msg, emotion, bot_reply, timestamp)
+        save_conversation_state(state)
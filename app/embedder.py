@@ -0,0 +1,117 @@
+"""Sentence embeddings from an int8-quantized ONNX export of all-MiniLM-L6-v2.
+
+The model is exported from PyTorch and dynamically quantized on first use, then
+served through onnxruntime, which avoids the PyTorch dispatch overhead that
+dominates when encoding one short sentence at a time.
+"""
+
+import os
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import onnxruntime as ort
+from transformers import AutoTokenizer
+
+MODEL_ID = "sentence-transformers/all-MiniLM-L6-v2"
+ONNX_DIR = Path("data/onnx/all-MiniLM-L6-v2")
+ONNX_FP32_PATH = ONNX_DIR / "model.onnx"
+ONNX_INT8_PATH = ONNX_DIR / "model_int8.onnx"
+EMBEDDING_DIM = 384
+MAX_SEQ_LENGTH = 256  # same limit SentenceTransformer applies for this model
+ENCODE_BATCH_SIZE = 64
+
+
+def _export_quantized_model():
+    """Export the transformer to ONNX and quantize its weights to int8."""
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModel
+
+    class _HiddenStates(torch.nn.Module):
+        """Binds the ONNX inputs by keyword, independent of forward()'s positional order."""
+
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            return self.model(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                token_type_ids=token_type_ids,
+            ).last_hidden_state
+
+    ONNX_DIR.mkdir(parents=True, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_ID)
+    model = _HiddenStates(AutoModel.from_pretrained(MODEL_ID)).eval()
+    tokenizer.save_pretrained(ONNX_DIR)
+
+    sample = tokenizer(["export"], return_tensors="pt")
+    input_names = ["input_ids", "attention_mask", "token_type_ids"]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            str(ONNX_FP32_PATH),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+            dynamo=False,
+        )
+
+    quantize_dynamic(str(ONNX_FP32_PATH), str(ONNX_INT8_PATH), weight_type=QuantType.QInt8)
+
+
+class Embedder:
+    """Mean-pooled, L2-normalized MiniLM embeddings via onnxruntime."""
+
+    def __init__(self):
+        if not ONNX_INT8_PATH.exists():
+            _export_quantized_model()
+
+        self.tokenizer = AutoTokenizer.from_pretrained(ONNX_DIR)
+
+        sess_options = ort.SessionOptions()
+        sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        sess_options.intra_op_num_threads = os.cpu_count() or 1
+        self.session = ort.InferenceSession(
+            str(ONNX_INT8_PATH),
+            sess_options=sess_options,
+            providers=["CPUExecutionProvider"],
+        )
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Embed texts as one padded batch; returns a (len(texts), EMBEDDING_DIM) float32 array."""
+        tokens = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=MAX_SEQ_LENGTH,
+            return_tensors="np",
+        )
+        feeds = {name: tokens[name].astype(np.int64) for name in self._input_names}
+        hidden = self.session.run(None, feeds)[0]
+
+        # Mean pooling over real tokens, then L2 normalization (matches the SentenceTransformer head)
+        mask = tokens["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+    def encode_many(self, texts: List[str], batch_size: int = ENCODE_BATCH_SIZE) -> np.ndarray:
+        """Embed an arbitrary number of texts in padded batches of batch_size."""
+        if not texts:
+            return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        return np.concatenate([
+            self.encode(texts[i:i + batch_size])
+            for i in range(0, len(texts), batch_size)
+        ])
+
+
+# load embedding model once
+embedder = Embedder()
@@ -1,11 +1,114 @@
+import os
+import queue
+import sys
+import threading
+from concurrent.futures import Future
+from typing import List, Tuple
+
+import torch
+from cachetools import LRUCache
 from transformers import pipeline
 
+MAX_BATCH_SIZE = 8
+BATCH_WAIT_SECONDS = 0.01  # how long to wait for more requests to join a batch
+EMOTION_CACHE_SIZE = int(os.getenv("EMOTION_CACHE_SIZE", "4096"))
+MAX_CACHED_TEXT_CHARS = 256  # longer messages rarely repeat, so they bypass the cache
+
+USE_CUDA = torch.cuda.is_available()
+
 # load emotion classification model once
-emotion_classifier = pipeline("text-classification", model="cardiffnlp/twitter-roberta-base-emotion")
+emotion_classifier = pipeline(
+    "text-classification",
+    model="cardiffnlp/twitter-roberta-base-emotion",
+    device=0 if USE_CUDA else -1,
+    batch_size=MAX_BATCH_SIZE,
+    truncation=True,
+    max_length=128,
+)
+
+if not USE_CUDA:
+    # int8 weights for every Linear layer; CPU inference runs on the int8 GEMM kernels
+    emotion_classifier.model = torch.ao.quantization.quantize_dynamic(
+        emotion_classifier.model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+class EmotionBatcher:
+    """Collects concurrent classification requests into padded batches.
+
+    A single background thread drains the queue, waiting briefly for up to
+    MAX_BATCH_SIZE texts, and runs them through the classifier in one call.
+    """
+
+    def __init__(self, max_batch_size: int = MAX_BATCH_SIZE, wait_seconds: float = BATCH_WAIT_SECONDS):
+        self.max_batch_size = max_batch_size
+        self.wait_seconds = wait_seconds
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="emotion-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, text: str) -> Future:
+        """Queue a text for classification and return a future for its label."""
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def _drain(self) -> List[Tuple[str, Future]]:
+        """Block for one request, then gather whatever arrives within the wait window."""
+        items = [self._queue.get()]
+        while len(items) < self.max_batch_size:
+            try:
+                items.append(self._queue.get(timeout=self.wait_seconds))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            items = self._drain()
+            try:
+                results = emotion_classifier([text for text, _ in items])
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(items, results):
+                # Interned so lookups against the persona's literal emotion keys hit by identity
+                future.set_result(sys.intern(result["label"]))
+
+
+_batcher = EmotionBatcher()
+
+
+def _normalize(text: str) -> str:
+    """Lowercase and collapse whitespace so trivial variants share a cache entry."""
+    return " ".join(text.lower().split())
+
+
+def _classify_raw(text: str) -> str:
+    """Run the classifier on text via the batching worker."""
+    return _batcher.submit(text).result()
+
+
+# Normalized text -> label. The classifier always sees the text as sent;
+# normalization only decides which messages share an entry.
+_emotion_cache: LRUCache = LRUCache(maxsize=EMOTION_CACHE_SIZE)
+_emotion_cache_lock = threading.Lock()
+
 
 def detect_emotion(text: str) -> str:
     """
     Returns the dominant emotion label for the given text.
     """
-    result = emotion_classifier(text)[0]
-    return result["label"]
+    normalized = _normalize(text)
+    if len(normalized) > MAX_CACHED_TEXT_CHARS:
+        return _classify_raw(text)
+    
+    with _emotion_cache_lock:
+        label = _emotion_cache.get(normalized)
+    if label is None:
+        label = _classify_raw(text)
+        with _emotion_cache_lock:
+            _emotion_cache[normalized] = label
+    return label
@@ -4,9 +4,14 @@ This module uses the google-generativeai library to generate responses
 from Gemini models with consistent character personality and emotional awareness.
 """
 
-from typing import Any, Optional
-import google.generativeai as genai
-from app.config import GEMINI_API_KEY, MODEL_NAME
+import asyncio
+from dataclasses import dataclass
+from datetime import timedelta
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from app.config import MODEL_NAME, get_genai
 from app.character import (
     JAKE_PERSONA,
     CharacterPersona, 
@@ -15,6 +20,156 @@ from app.character import (
     get_emotional_guidance
 )
 
+logger = logging.getLogger(__name__)
+
+# Lifetime of the server-side cached persona prefix
+PREFIX_CACHE_TTL = timedelta(hours=1)
+# Rebuild the cache this many seconds early so requests never reference an expired one
+PREFIX_CACHE_REFRESH_MARGIN = 60
+# After a transient caching failure, retry creating the cache after this many seconds
+PREFIX_CACHE_RETRY_SECONDS = 300
+
+# Hard caps on the per-turn prompt (~4 chars per token)
+MAX_CONTEXT_CHARS = 3000
+MAX_HISTORY_CHARS = 1500
+CONTEXT_SEPARATOR = "\n---\n"
+
+
+def join_context(docs: Sequence[str], max_chars: int = MAX_CONTEXT_CHARS) -> str:
+    """Join ranked documents into a context block of at most max_chars.
+    
+    Documents are taken greedily in rank order; one that would overflow the
+    budget is skipped in favour of shorter, lower-ranked ones. The top document
+    is always kept, truncated to the budget if it does not fit on its own.
+    
+    Args:
+        docs: Retrieved documents, best first
+        max_chars: Character budget for the joined block
+    
+    Returns:
+        Joined context string
+    """
+    if not docs:
+        return ""
+    if len(docs[0]) >= max_chars:
+        return docs[0][:max_chars]
+    
+    kept: List[str] = [docs[0]]
+    used = len(docs[0])
+    for doc in docs[1:]:
+        cost = len(CONTEXT_SEPARATOR) + len(doc)
+        if used + cost <= max_chars:
+            kept.append(doc)
+            used += cost
+    return CONTEXT_SEPARATOR.join(kept)
+
+
+def _clip_history(history: str, max_chars: int = MAX_HISTORY_CHARS) -> str:
+    """Keep the most recent lines of history that fit in max_chars."""
+    if len(history) <= max_chars:
+        return history
+    tail = history[-max_chars:]
+    # Drop the partial first line
+    newline = tail.find("\n")
+    return tail[newline + 1:] if newline != -1 else tail
+
+
+# Per-turn prompt, filled in a single format_map call by build_dynamic_suffix
+_SUFFIX_TEMPLATE = (
+    "# EMOTIONAL CONTEXT\n"
+    "The user is currently experiencing: **{emotion}**\n"
+    "\n"
+    "{emotional_guide}\n"
+    "\n"
+    "# RELEVANT MEMORIES & CONTEXT\n"
+    "Here are relevant past moments from our conversation:\n"
+    "{context}\n"
+    "\n"
+    "{history_block}"
+    "# CURRENT INTERACTION\n"
+    "User: {user_input}\n"
+    "\n"
+    "# YOUR RESPONSE\n"
+    "Respond as {name}, maintaining your character traits and responding appropriately to the user's {emotion}.\n"
+    "\n"
+    "{name}:"
+)
+_HISTORY_TEMPLATE = "# RECENT CONVERSATION\n{}\n\n"
+
+
+def build_static_prefix(persona: CharacterPersona = JAKE_PERSONA) -> str:
+    """Build the persona-only part of the prompt, sent once as cached context.
+    
+    Holds the character profile and the response guidance for every emotion the
+    persona has a pattern for, so per-turn requests only carry the dynamic suffix.
+    
+    Args:
+        persona: Character persona to use
+    
+    Returns:
+        Formatted prefix string
+    """
+    prompt_parts = [
+        "# YOUR ROLE",
+        get_character_context(persona),
+        "",
+        "# EMOTIONAL RESPONSE GUIDE",
+    ]
+    for emotion in persona.response_patterns:
+        prompt_parts.extend([
+            get_emotional_guidance(emotion, persona),
+            "",
+        ])
+    prompt_parts.append(
+        "Be authentic, empathetic, and true to your personality. Keep your response natural and conversational."
+    )
+    
+    return "\n".join(prompt_parts)
+
+
+def build_dynamic_suffix(
+    context: str,
+    user_input: str,
+    emotion: str,
+    persona: CharacterPersona = JAKE_PERSONA,
+    conversation_history: Optional[str] = None
+) -> str:
+    """Build the per-turn part of the prompt that follows the static prefix.
+    
+    Args:
+        context: Retrieved relevant memories/context
+        user_input: Current user message
+        emotion: Detected emotion
+        persona: Character persona to use
+        conversation_history: Recent conversation turns (optional)
+    
+    Returns:
+        Formatted suffix string
+    """
+    # Hard input budget; join_context already fits ranked docs within it
+    context = context[:MAX_CONTEXT_CHARS]
+    if conversation_history:
+        conversation_history = _clip_history(conversation_history)
+    
+    # Known emotions are covered by the cached guide; anything else gets the fallback inline
+    if emotion in persona.response_patterns:
+        emotional_guide = f"Follow the emotional response guidance for {emotion} above."
+    else:
+        emotional_guide = get_emotional_guidance(emotion, persona)
+    
+    if not context.strip():
+        context = "(No relevant history yet - this may be our first interaction)"
+    history_block = _HISTORY_TEMPLATE.format(conversation_history) if conversation_history else ""
+    
+    return _SUFFIX_TEMPLATE.format_map({
+        "emotion": emotion,
+        "emotional_guide": emotional_guide,
+        "context": context,
+        "history_block": history_block,
+        "user_input": user_input,
+        "name": persona.name,
+    })
+
 
 def build_emotional_prompt(
     context: str,
@@ -25,6 +180,8 @@ def build_emotional_prompt(
 ) -> str:
     """Build a comprehensive prompt with character and emotional awareness.
     
+    This is the static prefix followed by the dynamic suffix, as a single string.
+    
     Args:
         context: Retrieved relevant memories/context
         user_input: Current user message
@@ -35,43 +192,209 @@ def build_emotional_prompt(
     Returns:
         Formatted prompt string
     """
-    character_info = get_character_context(persona)
-    emotional_guide = get_emotional_guidance(emotion, persona)
+    suffix = build_dynamic_suffix(
+        context=context,
+        user_input=user_input,
+        emotion=emotion,
+        persona=persona,
+        conversation_history=conversation_history
+    )
+    return f"{build_static_prefix(persona)}\n\n{suffix}"
+
+
+# Safety settings are more permissive for emotional conversations
+SAFETY_SETTINGS = [
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "BLOCK_ONLY_HIGH",
+    },
+    {
+        "category": "HARM_CATEGORY_HATE_SPEECH",
+        "threshold": "BLOCK_ONLY_HIGH",
+    },
+    {
+        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "threshold": "BLOCK_ONLY_HIGH",
+    },
+    {
+        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "threshold": "BLOCK_ONLY_HIGH",
+    },
+]
+
+@dataclass(slots=True)
+class _PersonaModel:
+    """A model bound to a persona's static prefix, valid until expires_at."""
+    persona: CharacterPersona
+    model: Any
+    expires_at: float
+
+
+# Persona name -> model carrying that persona's cached prefix
+_cache_by_persona: Dict[str, _PersonaModel] = {}
+# Held across check-and-create so concurrent cold starts create one cached content
+_cache_lock = threading.Lock()
+
+
+def _is_prefix_too_small(error: Exception) -> bool:
+    """Whether the service rejected the prefix for being under its minimum token count."""
+    from google.api_core import exceptions as google_exceptions
     
-    prompt_parts = [
-        "# YOUR ROLE",
-        character_info,
-        "",
-        "# EMOTIONAL CONTEXT",
-        f"The user is currently experiencing: **{emotion}**",
-        "",
-        emotional_guide,
-        "",
-        "# RELEVANT MEMORIES & CONTEXT",
-        "Here are relevant past moments from our conversation:",
-        context if context.strip() else "(No relevant history yet - this may be our first interaction)",
-        "",
-    ]
+    message = str(error).lower()
+    return isinstance(error, google_exceptions.InvalidArgument) and (
+        "too small" in message or "min_total_token_count" in message
+    )
+
+
+def _get_persona_model(persona: CharacterPersona) -> Any:
+    """Get a model whose cached context holds the persona's static prefix.
     
-    if conversation_history:
-        prompt_parts.extend([
-            "# RECENT CONVERSATION",
-            conversation_history,
-            "",
-        ])
+    Uses Gemini context caching when the service accepts the prefix (it enforces
+    a minimum token count) and falls back to sending the prefix as a system
+    instruction otherwise. A prefix rejected as too small stays on the fallback;
+    any other caching failure is retried after PREFIX_CACHE_RETRY_SECONDS.
+    Entries are rebuilt when the persona object changes or the cache TTL is
+    about to run out. Safety settings are bound to the model here rather than
+    sent with every call.
+    """
+    with _cache_lock:
+        entry = _cache_by_persona.get(persona.name)
+        now = time.monotonic()
+        if entry is not None and entry.persona is persona and now < entry.expires_at:
+            return entry.model
+        
+        genai = get_genai()
+        prefix = build_static_prefix(persona)
+        try:
+            cache = genai.caching.CachedContent.create(
+                model=MODEL_NAME,
+                display_name=f"persona-{persona.name}",
+                system_instruction=prefix,
+                ttl=PREFIX_CACHE_TTL,
+            )
+            model = genai.GenerativeModel.from_cached_content(cache, safety_settings=SAFETY_SETTINGS)
+            expires_at = now + PREFIX_CACHE_TTL.total_seconds() - PREFIX_CACHE_REFRESH_MARGIN
+        except Exception as e:
+            model = genai.GenerativeModel(
+                MODEL_NAME, system_instruction=prefix, safety_settings=SAFETY_SETTINGS
+            )
+            if _is_prefix_too_small(e):
+                logger.info("Persona prefix below the caching minimum, using system instruction: %s", e)
+                expires_at = float("inf")
+            else:
+                logger.warning(
+                    "Context caching failed, using system instruction for %ds: %s",
+                    PREFIX_CACHE_RETRY_SECONDS, e
+                )
+                expires_at = now + PREFIX_CACHE_RETRY_SECONDS
+        
+        _cache_by_persona[persona.name] = _PersonaModel(persona, model, expires_at)
+        return model
+
+
+ERROR_REPLY = "I'm experiencing a technical difficulty, but I'm still here for you. Let's try continuing our conversation."
+
+
+def _prepare_request(
+    context: str,
+    user_input: str,
+    emotion: str,
+    persona: CharacterPersona,
+    conversation_history: Optional[str],
+    temperature: float,
+    max_tokens: int
+) -> Tuple[str, Dict[str, Any]]:
+    """Build the per-turn prompt and generation config for a reply request."""
+    prompt = build_dynamic_suffix(
+        context=context,
+        user_input=user_input,
+        emotion=emotion,
+        persona=persona,
+        conversation_history=conversation_history
+    )
     
-    prompt_parts.extend([
-        "# CURRENT INTERACTION",
-        f"User: {user_input}",
-        "",
-        "# YOUR RESPONSE",
-        f"Respond as {persona.name}, maintaining your character traits and responding appropriately to the user's {emotion}.",
-        "Be authentic, empathetic, and true to your personality. Keep your response natural and conversational.",
-        "",
-        f"{persona.name}:"
-    ])
+    # Debug: Log prompt stats (the persona prefix is cached and not counted here)
+    logger.debug("Prompt length: %d chars, ~%d words", len(prompt), len(prompt.split()))
     
-    return "\n".join(prompt_parts)
+    # Configure generation parameters - increase max tokens significantly
+    generation_config = {
+        "temperature": temperature,
+        "max_output_tokens": max_tokens,
+        "top_p": 0.95,
+        "top_k": 40,
+    }
+    logger.debug("Calling API with max_tokens=%d, temp=%s", max_tokens, temperature)
+    return prompt, generation_config
+
+
+def _extract_reply(response: Any) -> Tuple[str, bool]:
+    """Turn a Gemini response into reply text, with fallbacks for blocked or empty output.
+    
+    The flag is True only when the text came from the model, not a canned fallback.
+    """
+    candidate = response.candidates[0] if getattr(response, 'candidates', None) else None
+    
+    # Debug: Log the response structure (only rendered when DEBUG is enabled)
+    if logger.isEnabledFor(logging.DEBUG) and candidate is not None:
+        logger.debug("Candidate finish_reason: %s", candidate.finish_reason)
+        if hasattr(candidate, 'safety_ratings'):
+            logger.debug("Safety ratings: %s", candidate.safety_ratings)
+    
+    # Check for blocked response first
+    if hasattr(response, 'prompt_feedback'):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Prompt feedback: %s", response.prompt_feedback)
+        block_reason = getattr(response.prompt_feedback, 'block_reason', None)
+        if block_reason:
+            logger.info("Prompt blocked: %s", block_reason)
+            return "I want to respond thoughtfully to what you've shared. Could you tell me more in a different way?", False
+    
+    # Check candidate finish_reason (using the enum value directly)
+    finish_reason = None
+    if candidate is not None and hasattr(candidate, 'finish_reason'):
+        finish_reason = int(candidate.finish_reason)
+        
+        # FinishReason enum: FINISH_REASON_UNSPECIFIED=0, STOP=1, MAX_TOKENS=2, 
+        #                    SAFETY=3, RECITATION=4, OTHER=5
+        if finish_reason == 3:  # SAFETY
+            logger.info("Response blocked by safety filters")
+            return "I hear what you're sharing. Let me respond in a supportive way - could you share more about what you're feeling right now?", False
+        elif finish_reason == 2:  # MAX_TOKENS
+            logger.info("Response hit max tokens - trying to extract partial text")
+            # Continue to try extraction for partial response
+        elif finish_reason == 4:  # RECITATION
+            logger.info("Response blocked due to recitation")
+            return "I'd like to give you an original, thoughtful response. Could you rephrase what you shared?", False
+        elif finish_reason != 1:  # Not STOP or MAX_TOKENS
+            logger.info("Unexpected finish_reason: %d", finish_reason)
+    
+    # Extract text from response - defensive approach
+    try:
+        # Try the quick accessor first (read once; it joins the parts on every access)
+        text = response.text
+        if text:
+            return text.strip(), True
+    except (ValueError, AttributeError) as e:
+        # response.text raised an error, try manual extraction
+        logger.debug("response.text accessor failed: %s", e)
+    
+    # Manual extraction from candidates
+    parts = getattr(getattr(candidate, 'content', None), 'parts', None)
+    if parts:
+        text_parts = [part.text for part in parts if getattr(part, 'text', None)]
+        if text_parts:
+            result = " ".join(text_parts).strip()
+            logger.debug("Extracted %d chars from %d parts", len(result), len(parts))
+            return result, True
+    
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "No valid text in response. Type: %s, candidate content: %s",
+            type(response),
+            getattr(candidate, 'content', None)
+        )
+    
+    return "I'm here to support you. Could you tell me more about what you're experiencing?", False
 
 
 def generate_reply(
@@ -97,162 +420,56 @@ def generate_reply(
     Returns:
         Generated reply string, or empty string on error
     """
-    prompt = build_emotional_prompt(
-        context=context,
-        user_input=user_input,
-        emotion=emotion,
-        persona=persona,
-        conversation_history=conversation_history
+    prompt, generation_config = _prepare_request(
+        context, user_input, emotion, persona, conversation_history, temperature, max_tokens
     )
-    
-    # Debug: Log prompt stats
-    print(f"[llm.generate_reply] Prompt length: {len(prompt)} chars, ~{len(prompt.split())} words")
-    if len(prompt) > 10000:
-        print(f"[llm.generate_reply] WARNING: Very long prompt, may cause issues")
 
     try:
-        # Use the simple GenerativeModel interface
-        model = genai.GenerativeModel(MODEL_NAME)
-        
-        # Configure generation parameters - increase max tokens significantly
-        generation_config = {
-            "temperature": temperature,
-            "max_output_tokens": max_tokens,
-            "top_p": 0.95,
-            "top_k": 40,
-        }
-        
-        # Configure safety settings to be more permissive for emotional conversations
-        safety_settings = [
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_ONLY_HIGH",
-            },
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH",
-                "threshold": "BLOCK_ONLY_HIGH",
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_ONLY_HIGH",
-            },
-            {
-                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                "threshold": "BLOCK_ONLY_HIGH",
-            },
-        ]
-        
-        print(f"[llm.generate_reply] Calling API with max_tokens={max_tokens}, temp={temperature}")
-        
+        # Model carrying the persona's static prefix as cached context
+        model = _get_persona_model(persona)
         response = model.generate_content(
             prompt,
-            generation_config=generation_config,
-            safety_settings=safety_settings
+            generation_config=generation_config
         )
+        return _extract_reply(response)[0]
         
-        # Debug: Log the full response structure
-        print(f"[llm.generate_reply] Response received")
-        if hasattr(response, 'candidates') and response.candidates:
-            candidate = response.candidates[0]
-            print(f"[llm.generate_reply] Candidate finish_reason: {candidate.finish_reason}")
-            if hasattr(candidate, 'safety_ratings'):
-                print(f"[llm.generate_reply] Safety ratings: {candidate.safety_ratings}")
-        
-        # Check for blocked response first
-        if hasattr(response, 'prompt_feedback'):
-            print(f"[llm.generate_reply] Prompt feedback: {response.prompt_feedback}")
-            if hasattr(response.prompt_feedback, 'block_reason'):
-                block_reason = response.prompt_feedback.block_reason
-                if block_reason:
-                    print(f"[llm.generate_reply] Prompt blocked: {block_reason}")
-                    return "I want to respond thoughtfully to what you've shared. Could you tell me more in a different way?"
-        
-        # Check candidate finish_reason
-        if hasattr(response, 'candidates') and response.candidates:
-            candidate = response.candidates[0]
-            
-            # Check finish_reason (using the enum value directly)
-            if hasattr(candidate, 'finish_reason'):
-                finish_reason = int(candidate.finish_reason)
-                print(f"[llm.generate_reply] finish_reason numeric: {finish_reason}")
-                
-                # FinishReason enum: FINISH_REASON_UNSPECIFIED=0, STOP=1, MAX_TOKENS=2, 
-                #                    SAFETY=3, RECITATION=4, OTHER=5
-                if finish_reason == 3:  # SAFETY
-                    print(f"[llm.generate_reply] Response blocked by safety filters")
-                    return "I hear what you're sharing. Let me respond in a supportive way - could you share more about what you're feeling right now?"
-                elif finish_reason == 2:  # MAX_TOKENS
-                    print(f"[llm.generate_reply] Response hit max tokens - trying to extract partial text")
-                    # Continue to try extraction for partial response
-                elif finish_reason == 4:  # RECITATION
-                    print(f"[llm.generate_reply] Response blocked due to recitation")
-                    return "I'd like to give you an original, thoughtful response. Could you rephrase what you shared?"
-                elif finish_reason not in [1, 2]:  # Not STOP or MAX_TOKENS
-                    print(f"[llm.generate_reply] Unexpected finish_reason: {finish_reason}")
-        
-        # Extract text from response - defensive approach
-        try:
-            # Try the quick accessor first
-            text = response.text
-            if text:
-                return text.strip()
-        except (ValueError, AttributeError) as e:
-            # response.text raised an error, try manual extraction
-            print(f"[llm.generate_reply] response.text accessor failed: {e}")
-        
-        # Manual extraction from candidates
-        if hasattr(response, 'candidates') and response.candidates:
-            candidate = response.candidates[0]
-            print(f"[llm.generate_reply] Attempting manual extraction from candidate")
-            
-            if hasattr(candidate, 'content'):
-                content = candidate.content
-                print(f"[llm.generate_reply] Content type: {type(content)}")
-                print(f"[llm.generate_reply] Content: {content}")
-                
-                if hasattr(content, 'parts'):
-                    parts = content.parts
-                    print(f"[llm.generate_reply] Parts type: {type(parts)}, length: {len(parts) if parts else 0}")
-                    
-                    if parts and len(parts) > 0:
-                        print(f"[llm.generate_reply] Parts count: {len(parts)}")
-                        # Collect text from all parts
-                        text_parts = []
-                        for i, part in enumerate(parts):
-                            print(f"[llm.generate_reply] Part {i}: {type(part)}, {part}")
-                            if hasattr(part, 'text'):
-                                part_text = part.text
-                                if part_text:
-                                    print(f"[llm.generate_reply] Part {i} text length: {len(part_text)}")
-                                    text_parts.append(part_text)
-                            else:
-                                print(f"[llm.generate_reply] Part {i} has no text attribute")
-                        
-                        if text_parts:
-                            result = " ".join(text_parts).strip()
-                            print(f"[llm.generate_reply] Successfully extracted {len(result)} chars")
-                            return result
-                    else:
-                        print(f"[llm.generate_reply] Parts is None or empty: {parts}")
-                else:
-                    print(f"[llm.generate_reply] Content has no parts attribute")
-            else:
-                print(f"[llm.generate_reply] Candidate has no content")
-        
-        print(f"[llm.generate_reply] No valid text in response. Type: {type(response)}")
-        if hasattr(response, 'candidates'):
-            print(f"[llm.generate_reply] Candidates: {len(response.candidates) if response.candidates else 0}")
-        
-        # Last resort - check if this is truly empty or just blocked
-        if hasattr(response, 'candidates') and response.candidates:
-            candidate = response.candidates[0]
-            if hasattr(candidate, 'finish_reason') and int(candidate.finish_reason) == 3:
-                return "I'm here to listen and support you. Sometimes I need you to express things a bit differently so I can respond properly. What's most important for you to share right now?"
-        
-        return "I'm here to support you. Could you tell me more about what you're experiencing?"
+    except Exception:
+        logger.exception("Error calling model")
+        return ERROR_REPLY
+
+
+async def generate_reply_async(
+    context: str, 
+    user_input: str, 
+    emotion: str,
+    persona: CharacterPersona = DEFAULT_PERSONA,
+    conversation_history: Optional[str] = None,
+    temperature: float = 0.8,
+    max_tokens: int = 1500
+) -> Tuple[str, bool]:
+    """Async variant of generate_reply that awaits the Gemini call.
+
+    The HTTP round-trip goes through the SDK's async client, so the event loop
+    keeps serving other requests while the model responds. Takes the same
+    arguments as generate_reply.
+
+    Returns:
+        The reply, and whether it is model output (False for the error and
+        blocked/empty fallbacks, which callers should not cache)
+    """
+    prompt, generation_config = _prepare_request(
+        context, user_input, emotion, persona, conversation_history, temperature, max_tokens
+    )
+
+    try:
+        # Creating the cached context is a blocking call, made at most once per TTL
+        model = await asyncio.to_thread(_get_persona_model, persona)
+        response = await model.generate_content_async(
+            prompt,
+            generation_config=generation_config
+        )
+        return _extract_reply(response)
         
-    except Exception as e:
-        print(f"[llm.generate_reply] error calling model: {e}")
-        import traceback
-        traceback.print_exc()
-        return "I'm experiencing a technical difficulty, but I'm still here for you. Let's try continuing our conversation."
+    except Exception:
+        logger.exception("Error calling model")
+        return ERROR_REPLY, False
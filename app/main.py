@@ -8,20 +8,42 @@ This API provides emotionally-aware conversational AI with:
 """
 
 from fastapi import FastAPI, Body, HTTPException
-from typing import Optional
+from typing import Optional, Sequence
+import asyncio
+import hashlib
+import logging
 import time
 
+from cachetools import TTLCache
+
 from app.emotion_detector import detect_emotion
-from app.retriever import add_to_memory, retrieve_context, get_emotional_context_summary
-from app.llm import generate_reply
+from app.embedder import embedder
+from app.retriever import (
+    add_to_memory,
+    flush_pending,
+    retrieve_context,
+    get_emotional_context_summary
+)
+from app.llm import generate_reply_async, join_context
 from app.memory import add_turn
 from app.conversation_state import (
     get_conversation_state, 
     add_conversation_turn,
-    save_conversation_state
+    reset_conversation_state
 )
 from app.character import JAKE_PERSONA, CharacterPersona
 
+# Application loggers run at INFO; set to DEBUG to trace prompts and model responses
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:     %(name)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# Replies to exact repeats (same persona, message, emotion and prior conversation
+# history), for retries and duplicate sends. Only model output is cached, never
+# the error or blocked-response fallbacks, and only at low temperatures, since
+# higher temperatures are meant to vary between calls.
+REPLY_CACHE_MAX_TEMPERATURE = 0.3
+_reply_cache: TTLCache = TTLCache(maxsize=1024, ttl=600)
+
 app = FastAPI(
     title="Emotional RAG API",
     description="An emotionally intelligent AI companion with RAG-powered memory",
@@ -40,8 +62,23 @@ def root():
     }
 
 
+def _reply_cache_key(user_text: str, emotion: str, persona: CharacterPersona, history: str) -> str:
+    """Cache key for a reply to user_text given its emotion, persona and prior history."""
+    history_hash = hashlib.blake2b(history.encode(), digest_size=16).hexdigest()
+    return hashlib.blake2b(
+        f"{persona.name}|{emotion}|{history_hash}|{user_text}".encode(), digest_size=16
+    ).hexdigest()
+
+
+def _store_turn(user_text: str, emotion: str, reply: str, timestamp: int, embedding: Sequence[float]):
+    """Persist a chat turn to every memory store."""
+    add_to_memory(user_text, emotion, speaker="user", bot_reply=reply, embedding=embedding)
+    add_turn(user_text, emotion, reply)
+    add_conversation_turn(user_text, emotion, reply, timestamp)
+
+
 @app.post("/chat")
-def chat(user_input: dict = Body(...)):
+async def chat(user_input: dict = Body(...)):
     """
     Main chat endpoint with enhanced emotional RAG.
     
@@ -49,7 +86,8 @@ def chat(user_input: dict = Body(...)):
     {
       "message": "I feel lonely today.",
       "emotion_weight": 0.4,  // optional: how much to weight emotional similarity (0.0-1.0)
-      "use_recent_context": true  // optional: include recent conversation history
+      "use_recent_context": true,  // optional: include recent conversation history
+      "temperature": 0.8  // optional: sampling temperature; replies at <= 0.3 are cached
     }
     
     Returns:
@@ -69,44 +107,81 @@ def chat(user_input: dict = Body(...)):
         # Optional parameters
         emotion_weight = user_input.get("emotion_weight", 0.4)
         use_recent_context = user_input.get("use_recent_context", True)
+        temperature = user_input.get("temperature", 0.8)
+        if (
+            isinstance(temperature, bool)
+            or not isinstance(temperature, (int, float))
+            or not 0.0 <= temperature <= 2.0
+        ):
+            raise HTTPException(status_code=400, detail="temperature must be a number between 0.0 and 2.0")
         
         timestamp = int(time.time() * 1000)
 
-        # 1️⃣ Detect user emotion
-        emotion = detect_emotion(user_text)
+        # 1️⃣ Detect user emotion, embedding the message alongside
+        # (embedding computed once, reused for retrieval and when the turn is stored)
+        emotion, user_embeddings = await asyncio.gather(
+            asyncio.to_thread(detect_emotion, user_text),
+            asyncio.to_thread(embedder.encode, [user_text])
+        )
+        user_embedding = user_embeddings[0]
 
-        print ("[][][][][][][]emotion detected by the model is ", emotion, "[][][][]][]")
+        logger.debug("Emotion detected by the model: %s", emotion)
 
         # 2️⃣ Get conversation state for context
         conv_state = get_conversation_state()
         recent_history = conv_state.get_recent_context(n=3) if use_recent_context else None
 
-        # 3️⃣ Retrieve emotional context with enhanced strategy
-        context_docs = retrieve_context(
-            query=user_text,
-            emotion=emotion,
-            top_k=5,
-            emotion_weight=emotion_weight,
-            include_recent=True
-        )
-        context = "\n---\n".join(context_docs) if context_docs else ""
-
-        # 4️⃣ Generate AI reply with character consistency
-        reply = generate_reply(
-            context=context,
-            user_input=user_text,
-            emotion=emotion,
-            persona=JAKE_PERSONA,
-            conversation_history=recent_history
-        )
-
-        # 5️⃣ Store in memory systems
-        add_to_memory(user_text, emotion, speaker="user", bot_reply=reply)
-        add_turn(user_text, emotion, reply)
-        add_conversation_turn(user_text, emotion, reply, timestamp)
+        # Exact repeats (retries, duplicate sends) of a low-temperature turn reuse its reply.
+        # The first send is already stored, so the key uses the history from before it.
+        cache_key = None
+        cached = None
+        if temperature <= REPLY_CACHE_MAX_TEMPERATURE:
+            last_turn = conv_state.turns[-1] if conv_state.turns else None
+            is_repeat = (
+                last_turn is not None
+                and last_turn.user_message == user_text
+                and last_turn.user_emotion == emotion
+            )
+            prior_history = (
+                conv_state.get_recent_context(n=3, skip=1 if is_repeat else 0)
+                if use_recent_context else ""
+            )
+            cache_key = _reply_cache_key(user_text, emotion, JAKE_PERSONA, prior_history)
+            cached = _reply_cache.get(cache_key)
+
+        if cached is not None:
+            logger.debug("Reply served from cache")
+            reply, context_docs = cached
+        else:
+            # 3️⃣ Retrieve emotional context with enhanced strategy
+            context_docs = await asyncio.to_thread(
+                retrieve_context,
+                query=user_text,
+                emotion=emotion,
+                top_k=5,
+                emotion_weight=emotion_weight,
+                include_recent=True,
+                query_embedding=user_embedding
+            )
+            context = join_context(context_docs)
+
+            # 4️⃣ Generate AI reply with character consistency
+            reply, from_model = await generate_reply_async(
+                context=context,
+                user_input=user_text,
+                emotion=emotion,
+                persona=JAKE_PERSONA,
+                conversation_history=recent_history,
+                temperature=temperature
+            )
+            if cache_key is not None and from_model:
+                _reply_cache[cache_key] = (reply, context_docs)
+
+            # 5️⃣ Store in memory systems (blocking I/O, off the event loop); a repeat is not stored twice
+            await asyncio.to_thread(_store_turn, user_text, emotion, reply, timestamp, user_embedding)
 
         # 6️⃣ Get emotional insights
-        emotional_summary = get_emotional_context_summary(emotion, top_k=3)
+        emotional_summary = await asyncio.to_thread(get_emotional_context_summary, emotion, top_k=3)
         conv_state = get_conversation_state()  # Refresh after adding turn
 
         return {
@@ -117,15 +192,15 @@ def chat(user_input: dict = Body(...)):
             "conversation_stats": {
                 "turn_count": len(conv_state.turns),
                 "dominant_emotion": conv_state.dominant_emotion,
-                "emotional_journey": " → ".join(conv_state.emotion_history[-5:]) if conv_state.emotion_history else "Starting conversation"
+                "emotional_journey": " → ".join(conv_state.recent_emotions(5)) if conv_state.emotion_history else "Starting conversation"
             },
             "character": JAKE_PERSONA.name
         }
     
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error in chat endpoint: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in chat endpoint")
         raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
 
 
@@ -136,26 +211,21 @@ def get_state():
     return {
         "turn_count": len(state.turns),
         "dominant_emotion": state.dominant_emotion,
-        "emotion_history": state.emotion_history,
+        "emotion_history": list(state.emotion_history),
         "emotional_summary": state.get_emotional_summary(),
         "recent_context": state.get_recent_context(n=5)
     }
 
 
 @app.post("/conversation/reset")
-def reset_conversation():
+async def reset_conversation():
     """Reset conversation state (useful for starting fresh)."""
-    from app.conversation_state import ConversationState, STATE_FILE
-    import app.conversation_state as conv_module
-    
-    # Create new empty state
-    new_state = ConversationState()
-    conv_module._conversation_state = new_state
-    save_conversation_state(new_state)
-    
-    # Optionally clear state file
-    if STATE_FILE.exists():
-        STATE_FILE.unlink()
+    # Persist staged memories, then swap in an empty state and clear the state file
+    await asyncio.to_thread(flush_pending)
+    await asyncio.to_thread(reset_conversation_state)
+    # Cached replies were keyed on the history just deleted; cleared on the
+    # event loop, where /chat reads and fills the cache
+    _reply_cache.clear()
     
     return {"status": "conversation reset", "message": "Starting fresh with clean emotional slate"}
 
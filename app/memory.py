@@ -1,23 +1,47 @@
-import json
 from pathlib import Path
+from typing import Iterator
+
+import orjson
+
+MEMORY_FILE = Path("data/memory.jsonl")
+LEGACY_MEMORY_FILE = Path("data/memory.json")
+
+
+def _migrate_legacy_memory():
+    """Convert the old single-array memory.json into JSON Lines once."""
+    if MEMORY_FILE.exists() or not LEGACY_MEMORY_FILE.exists():
+        return
+    content = LEGACY_MEMORY_FILE.read_bytes().strip()
+    turns = orjson.loads(content) if content else []
+    MEMORY_FILE.write_bytes(b"".join(orjson.dumps(turn) + b"\n" for turn in turns))
+
+
+MEMORY_FILE.parent.mkdir(parents=True, exist_ok=True)
+_migrate_legacy_memory()
+# Unbuffered append handle, opened once: each turn is a single write at the end of the file
+_memory_file = MEMORY_FILE.open("ab", buffering=0)
+
+
+def iter_memory() -> Iterator[dict]:
+    if not MEMORY_FILE.exists():
+        return
+    with MEMORY_FILE.open("rb") as f:
+        for line in f:
+            if line.strip():
+                yield orjson.loads(line)
 
-MEMORY_FILE = Path("data/memory.json")
 
 def load_memory():
-    if MEMORY_FILE.exists():
-        content = MEMORY_FILE.read_text().strip()
-        if content:
-            return json.loads(content)
-    return []
+    return list(iter_memory())
+
 
 def save_memory(memory):
-    MEMORY_FILE.write_text(json.dumps(memory, indent=2))
+    MEMORY_FILE.write_bytes(b"".join(orjson.dumps(turn) + b"\n" for turn in memory))
+
 
 def add_turn(user_text: str, user_emotion: str, bot_reply: str):
-    memory = load_memory()
-    memory.append({
+    _memory_file.write(orjson.dumps({
         "user_text": user_text,
         "user_emotion": user_emotion,
         "bot_reply": bot_reply
-    })
-    save_memory(memory)
+    }) + b"\n")
@@ -6,15 +6,75 @@ This module implements emotion-aware retrieval that combines:
 3. Temporal relevance (recent context)
 """
 
-from sentence_transformers import SentenceTransformer
+import atexit
 import chromadb
+import threading
 import uuid
 import time
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Sequence
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
-chroma_client = chromadb.PersistentClient(path="data/embeddings")
-collection = chroma_client.get_or_create_collection(name="emotional_memory")
+import numpy as np
+from cachetools import LRUCache
+
+from app.embedder import embedder
+
+COLLECTION_NAME = "emotional_memory"
+LOAD_PAGE_SIZE = 1000
+QUERY_CACHE_SIZE = 256
+
+# Durable copy of every memory; only written to, in flush_pending
+persistent_client = chromadb.PersistentClient(path="data/embeddings")
+persistent_collection = persistent_client.get_or_create_collection(name=COLLECTION_NAME)
+
+# In-memory mirror that serves all queries
+chroma_client = chromadb.EphemeralClient()
+collection = chroma_client.get_or_create_collection(
+    name=COLLECTION_NAME,
+    metadata=persistent_collection.metadata  # same distance space as the persistent copy
+)
+
+
+def _load_into_memory():
+    """Copy the persistent collection into the in-memory one, a page at a time."""
+    offset = 0
+    while True:
+        page = persistent_collection.get(
+            include=["embeddings", "documents", "metadatas"],
+            limit=LOAD_PAGE_SIZE,
+            offset=offset
+        )
+        if not page["ids"]:
+            break
+        collection.add(
+            ids=page["ids"],
+            documents=page["documents"],
+            embeddings=page["embeddings"],
+            metadatas=page["metadatas"]
+        )
+        offset += len(page["ids"])
+
+
+_load_into_memory()
+
+# Chroma results per (quantized query embedding, n_results, emotion filter),
+# dropped whenever the collection changes
+_query_cache: LRUCache = LRUCache(maxsize=QUERY_CACHE_SIZE)
+_query_cache_lock = threading.Lock()
+_collection_version = 0
+
+# Memories are staged and written to Chroma in batches
+FLUSH_EVERY = 8
+FLUSH_MAX_AGE_SECONDS = 5.0
+
+_pending_ids: List[str] = []
+_pending_docs: List[str] = []
+_pending_embs: List[np.ndarray] = []  # float32 rows, 1.5 KB each
+_pending_meta: List[Dict] = []
+# Batches taken by a running flush but not yet in the in-memory collection;
+# still searched so they never drop out of retrieval mid-flush
+_inflight: List[Tuple[List[str], List[str], List[np.ndarray], List[Dict]]] = []
+_pending_lock = threading.Lock()
+_last_flush = time.monotonic()
 
 # Emotion similarity groups - emotions in same group are considered related
 EMOTION_GROUPS = {
@@ -23,25 +83,95 @@ EMOTION_GROUPS = {
     "neutral": ["surprise", "neutral", "curiosity"],
 }
 
+# Integer ids for known emotions. They are persisted as "emotion_id" in Chroma
+# metadata, so never renumber - only append new emotions. Labels outside the
+# table are stored without an emotion_id.
+EMOTION_ID: Dict[str, int] = {
+    "sadness": 0,
+    "anger": 1,
+    "fear": 2,
+    "disgust": 3,
+    "joy": 4,
+    "happiness": 5,
+    "excitement": 6,
+    "love": 7,
+    "surprise": 8,
+    "neutral": 9,
+    "curiosity": 10,
+    "optimism": 11,  # emitted by the classifier, belongs to no group
+}
+# Row of EMOTION_SIM shared by every unknown label; never persisted, so it may
+# move when the table grows
+UNKNOWN_EMOTION_ID = len(EMOTION_ID)
+_EMOTION_NAMES = {emotion_id: emotion for emotion, emotion_id in EMOTION_ID.items()}
+
+# Chroma `where` clause per grouped emotion, matching every emotion in its group
+_GROUP_FILTERS: Dict[str, Dict] = {
+    emotion: {"emotion": {"$in": group}}
+    for group in EMOTION_GROUPS.values()
+    for emotion in group
+}
+
+
+def _build_emotion_similarity() -> np.ndarray:
+    """Pairwise emotion similarity indexed by emotion id (last row/col = unknown)."""
+    size = UNKNOWN_EMOTION_ID + 1
+    sim = np.full((size, size), 0.3)  # Different groups
+    for group in EMOTION_GROUPS.values():
+        ids = [EMOTION_ID[e] for e in group]
+        sim[np.ix_(ids, ids)] = 0.7  # Same group
+    np.fill_diagonal(sim, 1.0)  # Same emotion
+    sim[UNKNOWN_EMOTION_ID, UNKNOWN_EMOTION_ID] = 0.3  # Two unknown labels need not match
+    return sim
+
+
+EMOTION_SIM = _build_emotion_similarity()
+
+
+def get_emotion_id(emotion: str) -> int:
+    """Map an emotion label to its id, or UNKNOWN_EMOTION_ID."""
+    return EMOTION_ID.get(emotion.lower(), UNKNOWN_EMOTION_ID)
+
+
+def _metadata_emotion_id(metadata: Dict) -> int:
+    """Emotion id of a stored memory, safe to index EMOTION_SIM with.
+    
+    A persisted emotion_id is trusted only while it still names the row's own
+    emotion label; anything else (missing, out of range, or an old unknown
+    sentinel that a later emotion took over) falls back to the label.
+    """
+    emotion = metadata.get("emotion", "neutral")
+    emotion_id = metadata.get("emotion_id")
+    if isinstance(emotion_id, int) and _EMOTION_NAMES.get(emotion_id) == emotion:
+        return emotion_id
+    return get_emotion_id(emotion)
+
+
+def get_emotion_filter(emotion: str) -> Dict:
+    """Chroma `where` clause selecting memories related to emotion."""
+    emotion = emotion.lower()
+    return _GROUP_FILTERS.get(emotion) or {"emotion": emotion}
+
+
 def get_emotion_similarity(emotion1: str, emotion2: str) -> float:
     """Calculate similarity score between two emotions (0.0 to 1.0)."""
     emotion1 = emotion1.lower()
     emotion2 = emotion2.lower()
     
-    # Same emotion = perfect match
+    # Same emotion = perfect match, including labels outside EMOTION_ID
     if emotion1 == emotion2:
         return 1.0
     
-    # Check if emotions are in same group
-    for group in EMOTION_GROUPS.values():
-        if emotion1 in group and emotion2 in group:
-            return 0.7  # High similarity within group
-    
-    # Different groups
-    return 0.3  # Low but non-zero base similarity
+    return float(EMOTION_SIM[get_emotion_id(emotion1), get_emotion_id(emotion2)])
 
 
-def add_to_memory(text: str, emotion: str, speaker: str = "user", bot_reply: Optional[str] = None):
+def add_to_memory(
+    text: str,
+    emotion: str,
+    speaker: str = "user",
+    bot_reply: Optional[str] = None,
+    embedding: Optional[Sequence[float]] = None
+):
     """
     Stores text + emotion embedding for future retrieval with enhanced metadata.
     
@@ -50,8 +180,11 @@ def add_to_memory(text: str, emotion: str, speaker: str = "user", bot_reply: Opt
         emotion: Detected emotion label
         speaker: Who said it ("user" or "bot")
         bot_reply: If storing user message, optionally include the bot's response
+        embedding: Precomputed embedding of text (encoded here if omitted)
     """
-    embedding = model.encode(text).tolist()
+    if embedding is None:
+        embedding = embedder.encode([text])[0]
+    embedding = np.asarray(embedding, dtype=np.float32)
     timestamp = int(time.time() * 1000)
     doc_id = f"{timestamp}_{uuid.uuid4().hex[:8]}"
     
@@ -60,14 +193,158 @@ def add_to_memory(text: str, emotion: str, speaker: str = "user", bot_reply: Opt
         "speaker": speaker,
         "timestamp": timestamp,
     }
+    emotion_id = get_emotion_id(emotion)
+    if emotion_id != UNKNOWN_EMOTION_ID:
+        metadata["emotion_id"] = emotion_id
     if bot_reply:
         metadata["bot_reply"] = bot_reply
     
-    collection.add(
-        ids=[doc_id],
-        documents=[text],
-        embeddings=[embedding],
-        metadatas=[metadata]
+    with _pending_lock:
+        _pending_ids.append(doc_id)
+        _pending_docs.append(text)
+        _pending_embs.append(embedding)
+        _pending_meta.append(metadata)
+        due = (
+            len(_pending_ids) >= FLUSH_EVERY
+            or time.monotonic() - _last_flush > FLUSH_MAX_AGE_SECONDS
+        )
+    if due:
+        flush_pending()
+
+
+def _drop_inflight(batch: Tuple) -> None:
+    """Remove batch from _inflight by identity (its rows hold arrays, so == is ambiguous)."""
+    for i, inflight in enumerate(_inflight):
+        if inflight is batch:
+            del _inflight[i]
+            return
+
+
+def flush_pending():
+    """Write all staged memories to Chroma in a single add per collection.
+    
+    The staged rows are swapped out under _pending_lock and written outside it,
+    so add_to_memory in other threads never waits on Chroma or the disk. If a
+    write fails the rows are staged again for the next flush.
+    """
+    global _last_flush, _collection_version
+    with _pending_lock:
+        _last_flush = time.monotonic()
+        if not _pending_ids:
+            return
+        taken = (list(_pending_ids), list(_pending_docs), list(_pending_embs), list(_pending_meta))
+        _pending_ids.clear()
+        _pending_docs.clear()
+        _pending_embs.clear()
+        _pending_meta.clear()
+        _inflight.append(taken)
+    
+    ids, docs, embs, metas = taken
+    in_memory = False
+    try:
+        batch = dict(ids=ids, documents=docs, embeddings=np.stack(embs), metadatas=metas)
+        # upsert: a retried batch may already be in the in-memory collection
+        collection.upsert(**batch)
+        in_memory = True
+        with _query_cache_lock:
+            _collection_version += 1
+            _query_cache.clear()
+        with _pending_lock:
+            _drop_inflight(taken)
+        persistent_collection.upsert(**batch)
+    except Exception:
+        with _pending_lock:
+            if not in_memory:
+                _drop_inflight(taken)
+            _pending_ids[:0] = ids
+            _pending_docs[:0] = docs
+            _pending_embs[:0] = embs
+            _pending_meta[:0] = metas
+        raise
+
+
+atexit.register(flush_pending)
+
+
+def _pending_snapshot() -> Tuple[List[str], List[str], List[np.ndarray], List[Dict]]:
+    """Copy of the staged and in-flight memories, for searching alongside Chroma."""
+    with _pending_lock:
+        ids, docs, embs, metas = (
+            list(_pending_ids), list(_pending_docs), list(_pending_embs), list(_pending_meta)
+        )
+        for batch_ids, batch_docs, batch_embs, batch_metas in _inflight:
+            ids += batch_ids
+            docs += batch_docs
+            embs += batch_embs
+            metas += batch_metas
+        return ids, docs, embs, metas
+
+
+def _query_collection(
+    query_embedding: List[float],
+    n_results: int,
+    emotion: Optional[str] = None
+) -> Dict:
+    """Nearest neighbours of query_embedding, optionally limited to emotion's group.
+    
+    Near-identical embeddings (equal after rounding to 1/256) share a cached result.
+    """
+    key = (
+        np.round(np.asarray(query_embedding) * 256).astype(np.int16).tobytes(),
+        n_results,
+        emotion
+    )
+    with _query_cache_lock:
+        results = _query_cache.get(key)
+        version = _collection_version
+    if results is not None:
+        return results
+    
+    kwargs = {"where": get_emotion_filter(emotion)} if emotion is not None else {}
+    results = collection.query(
+        query_embeddings=[query_embedding],
+        n_results=n_results,
+        include=["documents", "metadatas", "distances"],
+        **kwargs
+    )
+    with _query_cache_lock:
+        # Skip caching if a flush landed while the query ran
+        if version == _collection_version:
+            _query_cache[key] = results
+    return results
+
+
+def score_batch(
+    distances: np.ndarray,
+    emotion_ids: np.ndarray,
+    timestamps: np.ndarray,
+    query_emotion_id: int,
+    emotion_weight: float,
+    current_time: int,
+    emotion_sim: np.ndarray,
+    include_recent: bool
+) -> np.ndarray:
+    """Combined semantic/emotional/recency score per candidate.
+    
+    Timestamps below zero mark candidates without one; they get no decay.
+    """
+    # Semantic score (lower distance = higher similarity)
+    semantic = 1.0 / (1.0 + distances)
+    
+    # Emotional similarity score, gathered from the query emotion's row
+    emotion = emotion_sim[query_emotion_id, emotion_ids]
+    
+    # Recency score (exponential decay, 1 hour half-life)
+    if include_recent:
+        age_hours = (current_time - timestamps) / 3_600_000.0
+        recency = np.where(timestamps >= 0, np.power(0.5, age_hours), 1.0)
+    else:
+        recency = 1.0
+    
+    return (
+        (1.0 - emotion_weight) * semantic +
+        emotion_weight * emotion +
+        0.1 * recency  # Small recency boost
     )
 
 
@@ -76,13 +353,16 @@ def retrieve_context(
     emotion: str, 
     top_k: int = 5,
     emotion_weight: float = 0.4,
-    include_recent: bool = True
+    include_recent: bool = True,
+    query_embedding: Optional[Sequence[float]] = None
 ) -> List[str]:
     """
     Enhanced retrieval with emotion-awareness and hybrid ranking.
     
     Strategy:
-    1. Retrieve more candidates than needed (top_k * 2)
+    1. Retrieve candidates from the query emotion's group (top_k * 2), plus
+       a smaller unfiltered set (top_k) so other emotions can still surface,
+       plus any memories still staged for the next flush
     2. Re-rank based on:
        - Semantic similarity (from ChromaDB)
        - Emotional similarity
@@ -95,59 +375,81 @@ def retrieve_context(
         top_k: Number of results to return
         emotion_weight: Weight for emotional similarity (0.0-1.0)
         include_recent: Whether to boost recent memories
+        query_embedding: Precomputed embedding of query (encoded here if omitted)
     
     Returns:
         List of relevant context strings
     """
-    query_embedding = model.encode(query).tolist()
+    if query_embedding is None:
+        query_embedding = embedder.encode([query])[0]
+    query_embedding = np.asarray(query_embedding, dtype=np.float32).tolist()
     
-    # Retrieve more candidates for re-ranking
+    # Retrieve more candidates for re-ranking, filtered to related emotions
     n_candidates = max(top_k * 2, 10)
-    results = collection.query(
-        query_embeddings=[query_embedding], 
-        n_results=n_candidates,
-        include=["documents", "metadatas", "distances"]
-    )
+    related = _query_collection(query_embedding, n_candidates, emotion)
+    # Cross-group recall: nearest neighbours regardless of emotion
+    nearest = _query_collection(query_embedding, top_k)
+    
+    sources = [related, nearest]
+    # Memories not yet flushed are few; all of them are candidates
+    pending_ids, pending_docs, pending_embs, pending_meta = _pending_snapshot()
+    if pending_ids:
+        # Squared L2, matching the collection's distance function
+        pending_dists = np.square(
+            np.stack(pending_embs) - np.asarray(query_embedding, dtype=np.float32)
+        ).sum(axis=1).tolist()
+        sources.append({
+            "ids": [pending_ids],
+            "documents": [pending_docs],
+            "metadatas": [pending_meta],
+            "distances": [pending_dists]
+        })
     
-    if not results["documents"][0]:
+    seen = set()
+    documents, metadatas, distances = [], [], []
+    for results in sources:
+        for doc_id, doc, meta, dist in zip(
+            results["ids"][0],
+            results["documents"][0],
+            results["metadatas"][0],
+            results["distances"][0]
+        ):
+            if doc_id in seen:
+                continue
+            seen.add(doc_id)
+            documents.append(doc)
+            metadatas.append(meta)
+            distances.append(dist)
+    
+    if not documents:
         return []
     
     # Re-rank based on emotional similarity
-    scored_results = []
-    current_time = int(time.time() * 1000)
-    
-    for i, doc in enumerate(results["documents"][0]):
-        metadata = results["metadatas"][0][i]
-        distance = results["distances"][0][i] if "distances" in results else 0
-        
-        # Semantic score (lower distance = higher similarity)
-        semantic_score = 1.0 / (1.0 + distance)
-        
-        # Emotional similarity score
-        doc_emotion = metadata.get("emotion", "neutral")
-        emotion_score = get_emotion_similarity(emotion, doc_emotion)
-        
-        # Recency score (exponential decay, half-life of ~1 hour)
-        recency_score = 1.0
-        if include_recent and "timestamp" in metadata:
-            age_ms = current_time - metadata["timestamp"]
-            age_hours = age_ms / (1000 * 60 * 60)
-            recency_score = 0.5 ** (age_hours / 1.0)  # Decay with 1 hour half-life
-        
-        # Combined score with weights
-        combined_score = (
-            (1.0 - emotion_weight) * semantic_score +
-            emotion_weight * emotion_score +
-            0.1 * recency_score  # Small recency boost
-        )
-        
-        scored_results.append((doc, combined_score, metadata))
+    distances = np.asarray(distances, dtype=np.float64)
+    emotion_ids = np.asarray(
+        [_metadata_emotion_id(m) for m in metadatas],
+        dtype=np.int64
+    )
+    timestamps = np.asarray([m.get("timestamp", -1) for m in metadatas], dtype=np.int64)
+    scores = score_batch(
+        distances,
+        emotion_ids,
+        timestamps,
+        get_emotion_id(emotion),
+        float(emotion_weight),
+        int(time.time() * 1000),
+        EMOTION_SIM,
+        include_recent
+    )
     
-    # Sort by combined score (descending)
-    scored_results.sort(key=lambda x: x[1], reverse=True)
+    # Top_k by combined score (descending), without sorting the whole candidate set
+    if len(scores) > top_k:
+        top = np.argpartition(-scores, top_k)[:top_k]
+    else:
+        top = np.arange(len(scores))
+    top = top[np.argsort(-scores[top], kind="stable")]
     
-    # Return top_k documents
-    return [doc for doc, score, metadata in scored_results[:top_k]]
+    return [documents[i] for i in top]
 
 
 def get_emotional_context_summary(emotion: str, top_k: int = 3) -> str:
@@ -156,15 +458,18 @@ def get_emotional_context_summary(emotion: str, top_k: int = 3) -> str:
     
     Useful for understanding emotional patterns in the conversation history.
     """
-    # Query for similar emotional moments without semantic filtering
-    results = collection.query(
-        query_embeddings=[model.encode(emotion).tolist()],
-        n_results=top_k,
-        where={"emotion": emotion.lower()}
+    # Existence check by label only; no embedding or similarity search needed
+    label = emotion.lower()
+    results = collection.get(where={"emotion": label}, limit=top_k, include=[])
+    
+    # Staged memories are not in Chroma yet
+    _, _, _, pending_meta = _pending_snapshot()
+    count = min(
+        top_k,
+        len(results["ids"]) + sum(m["emotion"] == label for m in pending_meta)
     )
     
-    if not results["documents"][0]:
+    if not count:
         return f"This is the first time we're exploring {emotion} together."
     
-    count = len(results["documents"][0])
     return f"We've discussed {emotion} {count} time(s) before in our conversation."